@@ -27,6 +27,16 @@ def main():
             parser.exit(1)
 
 
+def positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a whole number")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} must be at least 1")
+    return number
+
+
 def setup_board_subparser(subparsers):
     boards_subparser = subparsers.add_parser("boards")
     boards_subparser.add_argument("--source", required=True, help="which environment to source the board from")
@@ -79,6 +89,12 @@ def setup_content_subparser(subparsers):
     content_subparser.add_argument("--debug", action="store_true", help="set logger to debug for more verbosity")
     content_subparser.add_argument("--recursive", action="store_true", help="Should folders deploy recursively")
     content_subparser.add_argument("--target-folder", help="override the default target folder with a custom path")
+    content_subparser.add_argument(
+        "--workers",
+        type=positive_int,
+        default=deploy_content.DEFAULT_WORKERS,
+        help="how many pieces of content to deploy at the same time"
+    )
     content_group = content_subparser.add_mutually_exclusive_group(required=True)
     content_group.add_argument("--folders", nargs="+", help="Folders to fully deploy")
     content_group.add_argument("--dashboards", nargs="+", help="Dashboards to deploy")
@@ -1,39 +1,77 @@
 import os
-import re
+import functools
 import subprocess
 import logging
 import tempfile
 import shutil
 import threading
-from concurrent.futures import ThreadPoolExecutor
-from itertools import repeat
+from collections import deque
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from looker_deployer.utils import deploy_logging
 from looker_deployer.utils import parse_ini
 from looker_sdk import client, models
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 logger = deploy_logging.get_logger(__name__)
 
+# number of content imports (and their gzr processes) allowed to run at the same time
+DEFAULT_WORKERS = 8
 
-def get_client(ini, env):
+# guards folder lookup/creation so concurrent deployments don't create the same folder twice
+space_lock = threading.Lock()
+
+# sdk -> parent_id -> {lowercased space name: [space_id]} for every parent folder listed during this run.
+# Folder ids are only meaningful on the instance they came from, so each sdk client gets its own listing
+space_children_cache = {}
+
+# sdk -> tuple of folder names from Shared down -> space_id, for every folder path resolved during this run
+space_path_cache = {}
+
+
+def get_client(ini, env, pool_size=DEFAULT_WORKERS):
     sdk = client.setup(config_file=ini, section=env)
+
+    # size the sdk's connection pool to the number of workers so concurrent api calls keep reusing
+    # open connections instead of queueing behind (or re-handshaking past) the default pool
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=3, backoff_factor=0.2)
+    )
+    sdk.transport.session.mount("https://", adapter)
+    sdk.transport.session.mount("http://", adapter)
+
     return sdk
 
 
 def get_space_ids_from_name(space_name, parent_id, sdk):
     if (space_name == "Shared" and parent_id == "0"):
         return ["1"]
-    space_list = sdk.search_spaces(name=space_name, parent_id=parent_id)
-    id_list = [i.id for i in space_list]
+    if parent_id == "0":
+        space_list = sdk.search_spaces(name=space_name, parent_id=parent_id)
+        return [i.id for i in space_list]
+
+    # list every child of the parent once and resolve sibling names locally from then on
+    instance_children = space_children_cache.setdefault(sdk, {})
+    if parent_id not in instance_children:
+        children = {}
+        for space in sdk.space_children(parent_id, fields="id,name"):
+            # name matching is case insensitive, same as search_spaces
+            children.setdefault(space.name.lower(), []).append(space.id)
+        instance_children[parent_id] = children
 
-    return id_list
+    return list(instance_children[parent_id].get(space_name.lower(), []))
 
 
 def create_or_return_space(space_name, parent_id, sdk):
 
     try:
         target_id = get_space_ids_from_name(space_name, parent_id, sdk)
-        logger.debug("Space ID from name", extra={"id": target_id})
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Space ID from name", extra={"id": target_id})
         assert len(target_id) == 1
     except AssertionError as e:
         if len(target_id) > 1:
@@ -43,6 +81,7 @@ def create_or_return_space(space_name, parent_id, sdk):
             logger.warning("No folders found. Creating folder now")
             new_space = models.Space(name=space_name, parent_id=parent_id)
             res = sdk.create_space(new_space)
+            space_children_cache.setdefault(sdk, {}).setdefault(parent_id, {})[space_name.lower()] = [res.id]
             return res.id
 
     logger.info("Found Space ID", extra={"id": target_id})
@@ -50,9 +89,16 @@ def create_or_return_space(space_name, parent_id, sdk):
 
 
 def get_gzr_creds(ini, env):
+    # key the cache on the file's modification time so edits to the ini are still picked up
+    mtime = os.path.getmtime(ini) if os.path.exists(ini) else None
+    return read_gzr_creds(ini, env, mtime)
+
+
+@functools.lru_cache(maxsize=8)
+def read_gzr_creds(ini, env, mtime):
     ini = parse_ini.read_ini(ini)
     env_record = ini[env]
-    host = env_record["base_url"].lstrip("https://").split(":")[0]
+    host = urlparse(env_record["base_url"]).hostname
     client_id = env_record["client_id"]
     client_secret = env_record["client_secret"]
     verify_ssl = env_record["verify_ssl"]
@@ -60,6 +106,27 @@ def get_gzr_creds(ini, env):
     return (host, client_id, client_secret, verify_ssl)
 
 
+def run_gzr(gzr_command):
+    # capture gzr's output rather than letting concurrent runs write over each other on the console.
+    # run() drains both pipes while waiting, so a chatty gzr can't fill a pipe and stall
+    debug = logger.isEnabledFor(logging.DEBUG)
+    result = subprocess.run(
+        gzr_command,
+        stdout=subprocess.PIPE if debug else subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+
+    if result.returncode != 0:
+        logger.error(
+            "gzr command failed",
+            extra={"returncode": result.returncode, "stderr": result.stderr.decode(errors="replace")}
+        )
+    elif debug:
+        logger.debug("gzr command complete", extra={"stdout": result.stdout.decode(errors="replace")})
+
+    return result
+
+
 def export_spaces(env, ini, path):
     host, client_id, client_secret, verify_ssl = get_gzr_creds(ini, env)
 
@@ -82,12 +149,12 @@ def export_spaces(env, ini, path):
     if verify_ssl == "False":
         gzr_command.append("--no-verify-ssl")
 
-    subprocess.run(gzr_command)
+    run_gzr(gzr_command)
 
 
-def import_content(content_type, content_json, space_id, env, ini):
+def import_content(content_type, content_json, space_id, creds):
     assert content_type in ["dashboard", "look"], "Unsupported Content Type"
-    host, client_id, client_secret, verify_ssl = get_gzr_creds(ini, env)
+    host, client_id, client_secret, verify_ssl = creds
 
     logger.info(
         "Deploying content",
@@ -113,171 +180,220 @@ def import_content(content_type, content_json, space_id, env, ini):
         client_id,
         "--client-secret",
         client_secret,
-        "--force"
+        "--force",
+        # reuse a single keep-alive connection to the host for the api calls gzr makes during the import
+        "--persistent"
     ]
 
     # config parser returns a string - easier to parse that than convert to a bool
     if verify_ssl == "False":
         gzr_command.append("--no-verify-ssl")
 
-    subprocess.run(gzr_command)
+    run_gzr(gzr_command)
 
 
 def build_spaces(spaces, sdk):
     # seeding initial value of parent id to Shared
-    # We use a list to aid in debugging should values not drain properly"
-    id_tracker = ["0"]
-
-    for space in spaces:
-        logger.debug("parent_id to use", extra={"id_tracker": id_tracker})
-        # Pull last value from id_tracker
-        space_parent = id_tracker.pop()
-
-        logger.debug("data for folder creation", extra={"folder": space, "folder_parent": space_parent})
-        space_id = create_or_return_space(space, space_parent, sdk)
-
-        # Add new id to id_tracker
-        id_tracker.append(space_id)
-        logger.debug("parent_id_tracker updated", extra={"parent_id_tracker": id_tracker})
-
-    # We need the final value of the id_tracker so we know what id to deploy content to
-    return id_tracker[0]
-
-
-def deploy_space(s, sdk, env, ini, recursive):
-
-    logger.debug("working folder", extra={"working_folder": s})
-
-    # grab the relevant files for deployment
-    space_files = [f for f in os.listdir(s) if os.path.isfile(os.path.join(s, f))]
-    space_children = [os.path.join(s, d) + os.sep for d in os.listdir(s) if os.path.isdir(os.path.join(s, d))]
-    look_files = [os.path.join(s, i) for i in space_files if re.search("^Look", i)]
-    dash_files = [os.path.join(s, i) for i in space_files if re.search("^Dashboard", i)]
-    logger.debug("files to process", extra={"looks": look_files, "dashboards": dash_files})
-
+    space_parent = "0"
+    # runs for every folder of every file deployed - skip building log records nobody will see
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    with space_lock:
+        # resolved ids only hold for the instance they were looked up on
+        instance_paths = space_path_cache.setdefault(sdk, {})
+        path = tuple(spaces)
+        # pick up below the deepest part of the path already resolved, only looking up the folders past it
+        start = 0
+        for depth in range(len(path), 0, -1):
+            if path[:depth] in instance_paths:
+                space_parent = instance_paths[path[:depth]]
+                start = depth
+                break
+
+        for depth, space in enumerate(path[start:], start + 1):
+            if debug:
+                logger.debug("data for folder creation", extra={"folder": space, "folder_parent": space_parent})
+            space_id = create_or_return_space(space, space_parent, sdk)
+
+            # remember every prefix of the path too, so content in sibling folders can reuse it
+            instance_paths[path[:depth]] = space_id
+            # each folder is the parent of the next one down
+            space_parent = space_id
+
+    # The final parent id is the folder to deploy content to
+    return space_parent
+
+
+def wait_for_content(futures):
+    # futures maps each submitted import to its content file.
+    # A failure is logged without stopping the rest of the batch, and handed back so the caller can fail the run
+    failures = []
+    for future in as_completed(futures):
+        try:
+            future.result()
+        except Exception as e:
+            logger.error("Content deployment failed", extra={"content": futures[future], "error": str(e)})
+            failures.append(e)
+
+    return failures
+
+
+def get_spaces_from_path(path):
     # cut down directory to looker-specific paths
-    a, b, c = s.partition("Shared")  # Hard coded to Shared for now TODO: Change this!
-    c = c.rpartition(os.sep)[0]
-    logger.debug("partition components", extra={"a": a, "b": b, "c": c})
+    a, b, c = path.partition("Shared")  # Hard coded to Shared for now TODO: Change this!
+    c = c.rpartition(os.sep)[0]  # strip trailing slash
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("partition components", extra={"a": a, "b": b, "c": c})
 
     # turn into a list of spaces to process
-    spaces_to_process = "".join([b, c]).split(os.sep)
-    logger.debug("folders to process", extra={"folders": spaces_to_process})
-
-    # The final value of id_tracker in build_spaces must be the targeted space id
-    space_id = build_spaces(spaces_to_process, sdk)
-    logger.debug("target folder id", extra={"folder_id": space_id})
-
-    # deploy looks
-    logger.debug("running looks", extra={"looks": look_files})
-    with ThreadPoolExecutor(max_workers=3) as pool:
-        pool.map(
-            import_content,
-            repeat("look"),
-            look_files,
-            repeat(space_id),
-            repeat(env),
-            repeat(ini)
-        )
-    # deploy dashboards
-    logger.debug("running dashboards", extra={"dashboards": dash_files})
-    with ThreadPoolExecutor(max_workers=3) as pool:
-        pool.map(
-            import_content,
-            repeat("dashboard"),
-            dash_files,
-            repeat(space_id),
-            repeat(env),
-            repeat(ini)
-        )
+    return "".join([b, c]).split(os.sep)
+
+
+def get_space_files(s):
+    # grab the relevant files for deployment in a single pass over the folder
+    # scandir hands back the entry type with the directory listing, saving a stat call per entry
+    look_files = []
+    dash_files = []
+    space_children = []
+    with os.scandir(s) as entries:
+        for entry in entries:
+            if entry.is_file():
+                if entry.name.startswith("Look"):
+                    look_files.append(entry.path)
+                elif entry.name.startswith("Dashboard"):
+                    dash_files.append(entry.path)
+            # don't descend through linked folders - a link back up the tree would never drain the folder queue
+            elif entry.is_dir(follow_symlinks=False):
+                space_children.append(entry.path + os.sep)
+
+    return look_files, dash_files, space_children
+
+
+def deploy_space(s, sdk, creds, recursive, pool):
+    debug = logger.isEnabledFor(logging.DEBUG)
+    look_futures = {}
+    dashboards = []
+
+    # walk the folder tree breadth first, submitting each folder's looks as soon as its id is known so child
+    # folders are resolved while earlier imports are still running on the pool
+    folders = deque([s])
+    while folders:
+        folder = folders.popleft()
+        if debug:
+            logger.debug("working folder", extra={"working_folder": folder})
+
+        look_files, dash_files, space_children = get_space_files(folder)
+        if debug:
+            logger.debug("files to process", extra={"looks": look_files, "dashboards": dash_files})
+
+        spaces_to_process = get_spaces_from_path(folder)
+        if debug:
+            logger.debug("folders to process", extra={"folders": spaces_to_process})
+
+        # The final folder resolved by build_spaces is the targeted space id
+        space_id = build_spaces(spaces_to_process, sdk)
+        if debug:
+            logger.debug("target folder id", extra={"folder_id": space_id})
+
+        # deploy looks on the shared pool, holding dashboards back until every look is in place
+        look_futures.update({pool.submit(import_content, "look", f, space_id, creds): f for f in look_files})
+        dashboards += [(f, space_id) for f in dash_files]
+
+        # queue up children for recursion
+        if recursive and space_children:
+            logger.info("Attemting Recursion of children folders", extra={"children_folders": space_children})
+            folders.extend(space_children)
+        else:
+            logger.info("No Recursion specified or empty child list", extra={"children_folders": space_children})
 
-    # go for recursion
-    if recursive and space_children:
-        logger.info("Attemting Recursion of children folders", extra={"children_folders": space_children})
-        for child in space_children:
-            deploy_space(child, sdk, env, ini, recursive)
-    else:
-        logger.info("No Recursion specified or empty child list", extra={"children_folders": space_children})
+    # gzr's dashboard import upserts the looks behind look-linked tiles by title in the target folder, so the
+    # look imports must finish first or both could try to create the same look
+    failures = wait_for_content(look_futures)
+    dash_futures = {pool.submit(import_content, "dashboard", f, space_id, creds): f for f, space_id in dashboards}
+    failures += wait_for_content(dash_futures)
 
+    return failures
 
-def deploy_content(content_type, content, sdk, env, ini):
-    # extract directory path
-    dirs = content.rpartition(os.sep)[0] + os.sep
 
-    # cut down directory to looker-specific paths
-    a, b, c = dirs.partition("Shared")  # Hard coded to Shared for now TODO: Change this!
-    c = c.rpartition(os.sep)[0]  # strip trailing slash
+def deploy_content(content_type, content, sdk, creds, target_folder=None):
+    # extract directory path - a target folder override stands in for the content's own directory
+    if target_folder:
+        # get_spaces_from_path needs the trailing sep, which callers other than main may not supply
+        dirs = os.path.join(target_folder, "")
+    else:
+        dirs = content.rpartition(os.sep)[0] + os.sep
 
-    # turn into a list of spaces to process
-    spaces_to_process = "".join([b, c]).split(os.sep)
+    spaces_to_process = get_spaces_from_path(dirs)
 
-    # The final value of id_tracker in build_spaces must be the targeted space id
+    # The final folder resolved by build_spaces is the targeted space id
     space_id = build_spaces(spaces_to_process, sdk)
 
-    import_content(content_type, content, space_id, env, ini)
+    import_content(content_type, content, space_id, creds)
+
+
+def deploy_target_space(s, target_folder, sdk, creds, recursive, pool):
+    # In order for recursion to continue to work properly, the actual directory needs to be updated
+    # Create a temporary directory to contain updated space. Context block will auto-clean when done
+    with tempfile.TemporaryDirectory() as d:
+        updated_space = os.path.join(d, target_folder).rstrip(os.sep)
+        os.makedirs(os.path.dirname(updated_space), exist_ok=True)
+        # link the target space override to the source space directory tree, only copying the tree
+        # where symlinks aren't available
+        try:
+            os.symlink(os.path.abspath(s), updated_space, target_is_directory=True)
+        except (OSError, NotImplementedError):
+            shutil.copytree(s, updated_space)
+        # kick off the job from the new space
+        return deploy_space(updated_space + os.sep, sdk, creds, recursive, pool)
 
 
 def send_content(
-    sdk, env, ini, target_folder=None, spaces=None, dashboards=None, looks=None, recursive=False
+    sdk,
+    env,
+    ini,
+    target_folder=None,
+    spaces=None,
+    dashboards=None,
+    looks=None,
+    recursive=False,
+    max_workers=DEFAULT_WORKERS
 ):
-
-    if spaces:
-        logger.debug("Deploying folders", extra={"folders": spaces})
-        # Loop through spaces
-        for s in spaces:
-            logger.debug("working folder", extra={"working_folder": s})
-            # Check for a target space override
-            if target_folder:
-                logger.info("target folder override found", extra={"target_folder": target_folder})
-                # In order for recursion to continue to work properly, the actual directory needs to be updated
-                # Create a temporary directory to contain updated space. Context block will auto-clean when done
-                with tempfile.TemporaryDirectory() as d:
-                    updated_space = os.path.join(d, target_folder)
-                    # copy the source space directory tree to target space override
-                    shutil.copytree(s, updated_space)
-                    # kick off the job from the new space
-                    deploy_space(updated_space, sdk, env, ini, recursive)
-            # If no target space override, kick off job normally
-            else:
-                deploy_space(s, sdk, env, ini, recursive)
-    if dashboards:
-        logger.debug("Deploying dashboards", extra={"dashboards": dashboards})
-        for dash in dashboards:
-            logger.debug("working dashboard", extra={"dashboard": dash})
-            # Check for target space override
-            if target_folder:
-                logger.info("target folder override found", extra={"target_folder": target_folder})
-                # In order for recursion to continue to work properly, the actual directory needs to be updated
-                # Create a temporary directory to contain updated space. Context block will auto-clean when done
-                with tempfile.TemporaryDirectory() as d:
-                    # copy the dashboard file to target space override
-                    target_dir = os.path.join(d, target_folder)
-                    os.makedirs(target_dir)
-                    shutil.copy(dash, target_dir)
-                    new_dash_path = [os.path.join(target_dir, f) for f in os.listdir(target_dir)][0]
-                    # kick off the job from the new space
-                    deploy_content("dashboard", new_dash_path, sdk, env, ini)
-            else:
-                deploy_content("dashboard", dash, sdk, env, ini)
-    if looks:
-        logger.debug("Deploying looks", extra={"looks": looks})
-        for look in looks:
-            logger.debug("working look", extra={"look": look})
-            # Check for target space override
-            if target_folder:
-                logger.info("target folder override found", extra={"target_folder": target_folder})
-                # In order for recursion to continue to work properly, the actual directory needs to be updated
-                # Create a temporary directory to contain updated space. Context block will auto-clean when done
-                with tempfile.TemporaryDirectory() as d:
-                    # copy the look file to target space override
-                    target_dir = os.path.join(d, target_folder)
-                    os.makedirs(target_dir)
-                    shutil.copy(look, target_dir)
-                    new_look_path = [os.path.join(target_dir, f) for f in os.listdir(target_dir)][0]
-                    # kick off the job from the new space
-                    deploy_content("look", new_look_path, sdk, env, ini)
-            else:
-                deploy_content("look", look, sdk, env, ini)
+    # credentials are the same for every piece of content, so only look them up once per deployment
+    creds = get_gzr_creds(ini, env)
+
+    failures = []
+    # one pool serves the whole deployment so worker threads are reused across folders and content
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        if spaces:
+            logger.debug("Deploying folders", extra={"folders": spaces})
+            # Loop through spaces
+            for s in spaces:
+                logger.debug("working folder", extra={"working_folder": s})
+                # Check for a target space override
+                if target_folder:
+                    logger.info("target folder override found", extra={"target_folder": target_folder})
+                    failures += deploy_target_space(s, target_folder, sdk, creds, recursive, pool)
+                # If no target space override, kick off job normally
+                else:
+                    failures += deploy_space(s, sdk, creds, recursive, pool)
+
+        if (dashboards or looks) and target_folder:
+            logger.info("target folder override found", extra={"target_folder": target_folder})
+        # gzr's dashboard import upserts the looks behind look-linked tiles by title in the target folder, so every
+        # look lands before any dashboard starts. Within each batch the content deploys concurrently
+        for content_type, content_files in (("look", looks), ("dashboard", dashboards)):
+            if content_files:
+                logger.debug("Deploying content", extra={"content_type": content_type, "content": content_files})
+                futures = {
+                    pool.submit(deploy_content, content_type, content, sdk, creds, target_folder): content
+                    for content in content_files
+                }
+                failures += wait_for_content(futures)
+
+    # every piece of content has had its attempt - now surface the first failure so the run doesn't look successful
+    if failures:
+        logger.error("Content deployment finished with failures", extra={"failure_count": len(failures)})
+        raise failures[0]
 
 
 def main(args):
@@ -298,7 +414,7 @@ def main(args):
         logger.info("Pulling content from dev", extra={"env": args.env, "pull_location": args.export})
         export_spaces(args.env, args.ini, args.export)
     else:
-        sdk = get_client(args.ini, args.env)
+        sdk = get_client(args.ini, args.env, args.workers)
         send_content(
             sdk,
             args.env,
@@ -307,5 +423,6 @@ def main(args):
             args.folders,
             args.dashboards,
             args.looks,
-            args.recursive
+            args.recursive,
+            args.workers
         )
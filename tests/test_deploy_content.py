@@ -1,6 +1,7 @@
 import pytest
 import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from looker_sdk import methods, models
 from looker_deployer.commands import deploy_content
 from looker_deployer.utils import parse_ini
@@ -26,6 +27,27 @@ FALSE_INI = {
 }
 
 
+@pytest.fixture
+def pool():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    deploy_content.space_children_cache.clear()
+    deploy_content.space_path_cache.clear()
+    deploy_content.read_gzr_creds.cache_clear()
+
+
+def test_get_client_connection_pool(mocker):
+    mocker.patch("looker_sdk.client.setup")
+    client_sdk = deploy_content.get_client("ini", "env", 16)
+    adapter = client_sdk.transport.session.mount.call_args[0][1]
+    assert adapter._pool_maxsize == 16
+    client_sdk.transport.session.mount.assert_any_call("https://", adapter)
+
+
 def test_get_space_ids_from_name_shared(mocker):
     mocker.patch.object(sdk, "search_spaces")
     id_list = deploy_content.get_space_ids_from_name("Shared", "0", sdk)
@@ -39,6 +61,49 @@ def test_get_space_ids_from_name_not_shared(mocker):
     assert id_list == ["42"]
 
 
+def test_get_space_ids_from_name_children(mocker):
+    mocker.patch.object(sdk, "space_children")
+    sdk.space_children.return_value = [
+        models.Space(name="Foo", parent_id="1", id="42"),
+        models.Space(name="Bar", parent_id="1", id="13")
+    ]
+    id_list = deploy_content.get_space_ids_from_name("foo", "1", sdk)
+    assert id_list == ["42"]
+
+
+def test_get_space_ids_from_name_children_cached(mocker):
+    mocker.patch.object(sdk, "space_children")
+    sdk.space_children.return_value = [
+        models.Space(name="Foo", parent_id="1", id="42"),
+        models.Space(name="Bar", parent_id="1", id="13")
+    ]
+    deploy_content.get_space_ids_from_name("Foo", "1", sdk)
+    id_list = deploy_content.get_space_ids_from_name("Bar", "1", sdk)
+    assert id_list == ["13"]
+    sdk.space_children.assert_called_once_with("1", fields="id,name")
+
+
+def test_get_space_ids_from_name_children_per_instance(mocker):
+    other_sdk = methods.LookerSDK("foo", "bar", "baz", "bosh")
+    mocker.patch.object(sdk, "space_children")
+    mocker.patch.object(other_sdk, "space_children")
+    sdk.space_children.return_value = [models.Space(name="Foo", parent_id="1", id="42")]
+    other_sdk.space_children.return_value = [models.Space(name="Foo", parent_id="1", id="13")]
+    deploy_content.get_space_ids_from_name("Foo", "1", sdk)
+    id_list = deploy_content.get_space_ids_from_name("Foo", "1", other_sdk)
+    assert id_list == ["13"]
+
+
+def test_get_space_ids_from_name_children_duplicates(mocker):
+    mocker.patch.object(sdk, "space_children")
+    sdk.space_children.return_value = [
+        models.Space(name="Foo", parent_id="1", id="42"),
+        models.Space(name="Foo", parent_id="1", id="13")
+    ]
+    id_list = deploy_content.get_space_ids_from_name("Foo", "1", sdk)
+    assert id_list == ["42", "13"]
+
+
 def test_create_or_return_space_one_found(mocker):
     mocker.patch("looker_deployer.commands.deploy_content.get_space_ids_from_name")
     deploy_content.get_space_ids_from_name.return_value = ["42"]
@@ -61,6 +126,7 @@ def test_create_or_return_space_none_found(mocker):
 
     target_id = deploy_content.create_or_return_space("foo", "2", sdk)
     assert target_id == "42"
+    assert deploy_content.space_children_cache[sdk]["2"]["foo"] == ["42"]
 
 
 def test_get_gzr_creds_true(mocker):
@@ -77,13 +143,36 @@ def test_get_gzr_creds_false(mocker):
     assert tup == ("foobarbaz.com", "abc", "xyz", "False")
 
 
+def test_get_gzr_creds_host_prefix(mocker):
+    mocker.patch("looker_deployer.utils.parse_ini.read_ini")
+    parse_ini.read_ini.return_value = {
+        "taco": {
+            "base_url": "https://sandbox.foobarbaz.com:19999",
+            "client_id": "abc",
+            "client_secret": "xyz",
+            "verify_ssl": "True"
+        }
+    }
+    tup = deploy_content.get_gzr_creds("foo", "taco")
+    assert tup == ("sandbox.foobarbaz.com", "abc", "xyz", "True")
+
+
+def test_get_gzr_creds_cached(mocker):
+    mocker.patch("looker_deployer.utils.parse_ini.read_ini")
+    parse_ini.read_ini.return_value = TRUE_INI
+    deploy_content.get_gzr_creds("foo", "taco")
+    tup = deploy_content.get_gzr_creds("foo", "taco")
+    assert tup == ("foobarbaz.com", "abc", "xyz", "True")
+    parse_ini.read_ini.assert_called_once_with("foo")
+
+
 def test_export_space(mocker):
     mocker.patch("looker_deployer.commands.deploy_content.get_gzr_creds")
     deploy_content.get_gzr_creds.return_value = ("foobar.com", "abc", "xyz", "True")
 
-    mocker.patch("subprocess.run")
+    mocker.patch("looker_deployer.commands.deploy_content.run_gzr")
     deploy_content.export_spaces("env", "ini", "foo/bar")
-    subprocess.run.assert_called_with([
+    deploy_content.run_gzr.assert_called_with([
         "gzr",
         "space",
         "export",
@@ -103,9 +192,9 @@ def test_export_space_no_verify_ssl(mocker):
     mocker.patch("looker_deployer.commands.deploy_content.get_gzr_creds")
     deploy_content.get_gzr_creds.return_value = ("foobar.com", "abc", "xyz", "False")
 
-    mocker.patch("subprocess.run")
+    mocker.patch("looker_deployer.commands.deploy_content.run_gzr")
     deploy_content.export_spaces("env", "ini", "foo/bar")
-    subprocess.run.assert_called_with([
+    deploy_content.run_gzr.assert_called_with([
         "gzr",
         "space",
         "export",
@@ -123,12 +212,9 @@ def test_export_space_no_verify_ssl(mocker):
 
 
 def test_import_content(mocker):
-    mocker.patch("looker_deployer.commands.deploy_content.get_gzr_creds")
-    deploy_content.get_gzr_creds.return_value = ("foobar.com", "abc", "xyz", "True")
-
-    mocker.patch("subprocess.run")
-    deploy_content.import_content("dashboard", "tacocat.json", "42", "env", "ini")
-    subprocess.run.assert_called_with([
+    mocker.patch("looker_deployer.commands.deploy_content.run_gzr")
+    deploy_content.import_content("dashboard", "tacocat.json", "42", ("foobar.com", "abc", "xyz", "True"))
+    deploy_content.run_gzr.assert_called_with([
         "gzr",
         "dashboard",
         "import",
@@ -140,17 +226,15 @@ def test_import_content(mocker):
         "abc",
         "--client-secret",
         "xyz",
-        "--force"
+        "--force",
+        "--persistent"
     ])
 
 
 def test_import_content_no_verify_ssl(mocker):
-    mocker.patch("looker_deployer.commands.deploy_content.get_gzr_creds")
-    deploy_content.get_gzr_creds.return_value = ("foobar.com", "abc", "xyz", "False")
-
-    mocker.patch("subprocess.run")
-    deploy_content.import_content("dashboard", "tacocat.json", "42", "env", "ini")
-    subprocess.run.assert_called_with([
+    mocker.patch("looker_deployer.commands.deploy_content.run_gzr")
+    deploy_content.import_content("dashboard", "tacocat.json", "42", ("foobar.com", "abc", "xyz", "False"))
+    deploy_content.run_gzr.assert_called_with([
         "gzr",
         "dashboard",
         "import",
@@ -163,10 +247,26 @@ def test_import_content_no_verify_ssl(mocker):
         "--client-secret",
         "xyz",
         "--force",
+        "--persistent",
         "--no-verify-ssl"
     ])
 
 
+def test_run_gzr(mocker):
+    mocker.patch("subprocess.run")
+    subprocess.run.return_value = subprocess.CompletedProcess(["gzr"], 0, None, b"")
+    deploy_content.run_gzr(["gzr", "space", "export"])
+    subprocess.run.assert_called_with(["gzr", "space", "export"], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def test_run_gzr_failure(mocker):
+    mocker.patch("subprocess.run")
+    subprocess.run.return_value = subprocess.CompletedProcess(["gzr"], 1, None, b"boom")
+    mocker.patch.object(deploy_content.logger, "error")
+    deploy_content.run_gzr(["gzr", "space", "export"])
+    deploy_content.logger.error.assert_called_once()
+
+
 def test_build_spaces(mocker):
     mocker.patch("looker_deployer.commands.deploy_content.create_or_return_space")
     deploy_content.create_or_return_space.return_value = "42"
@@ -174,69 +274,136 @@ def test_build_spaces(mocker):
     assert space_id == "42"
 
 
-def test_deploy_space_build_call(mocker):
+def test_build_spaces_cached(mocker):
+    mocker.patch("looker_deployer.commands.deploy_content.create_or_return_space")
+    deploy_content.create_or_return_space.side_effect = ["1", "42"]
+    deploy_content.build_spaces(["Shared", "taco"], sdk)
+    space_id = deploy_content.build_spaces(["Shared", "taco"], sdk)
+    assert space_id == "42"
+    assert deploy_content.create_or_return_space.call_count == 2
+    assert deploy_content.space_path_cache == {sdk: {("Shared",): "1", ("Shared", "taco"): "42"}}
+
+
+def test_build_spaces_cached_per_instance(mocker):
+    other_sdk = methods.LookerSDK("foo", "bar", "baz", "bosh")
+    mocker.patch("looker_deployer.commands.deploy_content.create_or_return_space")
+    deploy_content.create_or_return_space.side_effect = ["1", "13"]
+    deploy_content.space_path_cache[sdk] = {("Shared",): "1", ("Shared", "taco"): "42"}
+    space_id = deploy_content.build_spaces(["Shared", "taco"], other_sdk)
+    assert space_id == "13"
+    assert deploy_content.create_or_return_space.call_count == 2
+
+
+def test_build_spaces_cached_prefix(mocker):
+    mocker.patch("looker_deployer.commands.deploy_content.create_or_return_space")
+    deploy_content.create_or_return_space.return_value = "13"
+    deploy_content.space_path_cache[sdk] = {("Shared", "taco"): "42"}
+    space_id = deploy_content.build_spaces(["Shared", "taco", "cat"], sdk)
+    assert space_id == "13"
+    deploy_content.create_or_return_space.assert_called_once_with("cat", "42", sdk)
+    assert deploy_content.space_path_cache[sdk][("Shared", "taco", "cat")] == "13"
+
+
+def test_get_spaces_from_path():
+    spaces = deploy_content.get_spaces_from_path("Foo/Shared/Bar/Baz/")
+    assert spaces == ["Shared", "Bar", "Baz"]
+
+
+def mock_scandir(mocker, folder, file_names):
+    entries = []
+    for name in file_names:
+        entry = mocker.Mock()
+        entry.name = name
+        entry.path = os.path.join(folder, name)
+        entry.is_file.return_value = True
+        entries.append(entry)
+
+    mocker.patch("os.scandir")
+    os.scandir.return_value.__enter__.return_value = entries
+
+
+def test_get_space_files(tmp_path):
+    (tmp_path / "Baz").mkdir()
+    (tmp_path / "Look_test").write_text("{}")
+    (tmp_path / "Dashboard_test").write_text("{}")
+    (tmp_path / "Space_test").write_text("{}")
+
+    looks, dashboards, children = deploy_content.get_space_files(str(tmp_path))
+    assert looks == [str(tmp_path / "Look_test")]
+    assert dashboards == [str(tmp_path / "Dashboard_test")]
+    assert children == [str(tmp_path / "Baz") + os.sep]
+
 
-    mocker.patch("os.listdir")
-    mocker.patch("os.path.isfile")
-    mocker.patch("os.path.isdir")
+def test_get_space_files_skips_linked_folders(tmp_path):
+    (tmp_path / "Baz").mkdir()
+    os.symlink(str(tmp_path), str(tmp_path / "Baz" / "Loop"), target_is_directory=True)
 
-    os.listdir.return_value = ["Dashboard", "Look"]
-    os.path.isfile.return_value = True
-    os.path.isdir.return_value = True
+    looks, dashboards, children = deploy_content.get_space_files(str(tmp_path / "Baz"))
+    assert children == []
+
+
+def test_deploy_space_build_call(mocker, pool):
+
+    mock_scandir(mocker, "Foo/Shared/Bar/", ["Dashboard", "Look"])
 
     mocker.patch("looker_deployer.commands.deploy_content.build_spaces")
     mocker.patch("looker_deployer.commands.deploy_content.import_content")
-    deploy_content.deploy_space("Foo/Shared/Bar/", "sdk", "env", "ini", False)
+    deploy_content.deploy_space("Foo/Shared/Bar/", "sdk", "creds", False, pool)
     deploy_content.build_spaces.assert_called_with(["Shared", "Bar"], "sdk")
 
 
-def test_deploy_space_look_call(mocker):
-
-    mocker.patch("os.listdir")
-    mocker.patch("os.path.isfile")
-    mocker.patch("os.path.isdir")
+def test_deploy_space_look_call(mocker, pool):
 
-    os.listdir.return_value = ["Look_test"]
-    os.path.isfile.return_value = True
-    os.path.isdir.return_value = True
+    mock_scandir(mocker, "Foo/Shared/Bar", ["Look_test"])
 
     mocker.patch("looker_deployer.commands.deploy_content.build_spaces")
     deploy_content.build_spaces.return_value = "42"
 
     mocker.patch("looker_deployer.commands.deploy_content.import_content")
-    deploy_content.deploy_space("Foo/Shared/Bar", "sdk", "env", "ini", False)
-    deploy_content.import_content.assert_called_once_with("look", "Foo/Shared/Bar/Look_test", "42", "env", "ini")
+    deploy_content.deploy_space("Foo/Shared/Bar", "sdk", "creds", False, pool)
+    deploy_content.import_content.assert_called_once_with("look", "Foo/Shared/Bar/Look_test", "42", "creds")
 
 
-def test_deploy_space_dashboard_call(mocker):
+def test_deploy_space_dashboard_call(mocker, pool):
 
-    mocker.patch("os.listdir")
-    mocker.patch("os.path.isfile")
-    mocker.patch("os.path.isdir")
-
-    os.listdir.return_value = ["Dashboard_test"]
-    os.path.isfile.return_value = True
-    os.path.isdir.return_value = True
+    mock_scandir(mocker, "Foo/Shared/Bar", ["Dashboard_test"])
 
     mocker.patch("looker_deployer.commands.deploy_content.build_spaces")
     deploy_content.build_spaces.return_value = "42"
 
     mocker.patch("looker_deployer.commands.deploy_content.import_content")
-    deploy_content.deploy_space("Foo/Shared/Bar", "sdk", "env", "ini", False)
+    deploy_content.deploy_space("Foo/Shared/Bar", "sdk", "creds", False, pool)
     deploy_content.import_content.assert_called_once_with(
         "dashboard",
         "Foo/Shared/Bar/Dashboard_test",
         "42",
-        "env",
-        "ini"
+        "creds"
     )
 
 
+def test_deploy_space_looks_before_dashboards(mocker, tmp_path, pool):
+    child = tmp_path / "Shared" / "Bar" / "Baz"
+    child.mkdir(parents=True)
+    (tmp_path / "Shared" / "Bar" / "Dashboard_test").write_text("{}")
+    (child / "Look_test").write_text("{}")
+
+    order = []
+
+    def record_import(content_type, content_json, space_id, creds):
+        order.append(content_type)
+
+    mocker.patch("looker_deployer.commands.deploy_content.build_spaces")
+    mocker.patch("looker_deployer.commands.deploy_content.import_content")
+    deploy_content.import_content.side_effect = record_import
+    deploy_content.deploy_space(str(tmp_path / "Shared" / "Bar") + os.sep, "sdk", "creds", True, pool)
+    assert order == ["look", "dashboard"]
+
+
 def test_deploy_content_build_call(mocker):
 
     mocker.patch("looker_deployer.commands.deploy_content.build_spaces")
     mocker.patch("looker_deployer.commands.deploy_content.import_content")
-    deploy_content.deploy_content("look", "Foo/Shared/Bar/Baz/Dashboard_test.json", "sdk", "env", "ini")
+    deploy_content.deploy_content("look", "Foo/Shared/Bar/Baz/Dashboard_test.json", "sdk", "creds")
     deploy_content.build_spaces.assert_called_with(["Shared", "Bar", "Baz"], "sdk")
 
 
@@ -245,5 +412,118 @@ def test_deploy_content_import_content_call(mocker):
     deploy_content.build_spaces.return_value = "42"
 
     mocker.patch("looker_deployer.commands.deploy_content.import_content")
-    deploy_content.deploy_content("look", "Foo/Shared/Bar/Look_test.json", "sdk", "env", "ini")
-    deploy_content.import_content.assert_called_with("look", "Foo/Shared/Bar/Look_test.json", "42", "env", "ini")
+    deploy_content.deploy_content("look", "Foo/Shared/Bar/Look_test.json", "sdk", "creds")
+    deploy_content.import_content.assert_called_with("look", "Foo/Shared/Bar/Look_test.json", "42", "creds")
+
+
+def test_deploy_content_target_folder(mocker):
+    mocker.patch("looker_deployer.commands.deploy_content.build_spaces")
+    deploy_content.build_spaces.return_value = "42"
+
+    mocker.patch("looker_deployer.commands.deploy_content.import_content")
+    deploy_content.deploy_content("look", "Foo/Shared/Bar/Look_test.json", "sdk", "creds", "Shared/Taco/")
+    deploy_content.build_spaces.assert_called_with(["Shared", "Taco"], "sdk")
+    deploy_content.import_content.assert_called_with("look", "Foo/Shared/Bar/Look_test.json", "42", "creds")
+
+
+def test_deploy_content_target_folder_no_trailing_sep(mocker):
+    mocker.patch("looker_deployer.commands.deploy_content.build_spaces")
+    deploy_content.build_spaces.return_value = "42"
+
+    mocker.patch("looker_deployer.commands.deploy_content.import_content")
+    deploy_content.deploy_content("look", "Foo/Shared/Bar/Look_test.json", "sdk", "creds", "Shared/Taco")
+    deploy_content.build_spaces.assert_called_with(["Shared", "Taco"], "sdk")
+
+
+def test_send_content_dashboards_and_looks(mocker):
+    mocker.patch("looker_deployer.commands.deploy_content.get_gzr_creds")
+    deploy_content.get_gzr_creds.return_value = "creds"
+    mocker.patch("looker_deployer.commands.deploy_content.deploy_content")
+    deploy_content.send_content(
+        "sdk",
+        "env",
+        "ini",
+        dashboards=["Foo/Shared/Dashboard_test.json"],
+        looks=["Foo/Shared/Look_test.json"]
+    )
+    deploy_content.deploy_content.assert_any_call("dashboard", "Foo/Shared/Dashboard_test.json", "sdk", "creds", None)
+    deploy_content.deploy_content.assert_any_call("look", "Foo/Shared/Look_test.json", "sdk", "creds", None)
+    deploy_content.get_gzr_creds.assert_called_once_with("ini", "env")
+
+
+def test_send_content_failure_continues(mocker):
+    mocker.patch("looker_deployer.commands.deploy_content.get_gzr_creds")
+    mocker.patch("looker_deployer.commands.deploy_content.deploy_content")
+    deploy_content.deploy_content.side_effect = [AssertionError("boom"), None]
+    with pytest.raises(AssertionError, match="boom"):
+        deploy_content.send_content("sdk", "env", "ini", looks=["Look_1.json", "Look_2.json"], max_workers=1)
+    assert deploy_content.deploy_content.call_count == 2
+
+
+def test_send_content_looks_before_dashboards(mocker):
+    order = []
+
+    def record_content(content_type, content, sdk, creds, target_folder):
+        order.append(content_type)
+
+    mocker.patch("looker_deployer.commands.deploy_content.get_gzr_creds")
+    mocker.patch("looker_deployer.commands.deploy_content.deploy_content")
+    deploy_content.deploy_content.side_effect = record_content
+    deploy_content.send_content(
+        "sdk",
+        "env",
+        "ini",
+        dashboards=["Dashboard_1.json", "Dashboard_2.json"],
+        looks=["Look_1.json", "Look_2.json"]
+    )
+    assert order == ["look", "look", "dashboard", "dashboard"]
+
+
+def test_send_content_folder_failure_raises(mocker):
+    mocker.patch("looker_deployer.commands.deploy_content.get_gzr_creds")
+    mocker.patch("looker_deployer.commands.deploy_content.deploy_space")
+    deploy_content.deploy_space.side_effect = [[AssertionError("boom")], []]
+    with pytest.raises(AssertionError, match="boom"):
+        deploy_content.send_content("sdk", "env", "ini", spaces=["Foo/Shared/Bar/", "Foo/Shared/Baz/"])
+    assert deploy_content.deploy_space.call_count == 2
+
+
+def test_send_content_spaces_target_folder(mocker, tmp_path):
+    source = tmp_path / "Shared" / "Bar"
+    source.mkdir(parents=True)
+    (source / "Look_test").write_text("{}")
+
+    deployed = {}
+
+    def record_space(s, sdk, creds, recursive, pool):
+        deployed["path"] = s
+        deployed["files"] = os.listdir(s)
+        return []
+
+    mocker.patch("looker_deployer.commands.deploy_content.get_gzr_creds")
+    mocker.patch("looker_deployer.commands.deploy_content.deploy_space")
+    deploy_content.deploy_space.side_effect = record_space
+    deploy_content.send_content("sdk", "env", "ini", target_folder="Shared/Taco/", spaces=[str(source)])
+    assert deployed["path"].endswith(os.path.join("Shared", "Taco") + os.sep)
+    assert deployed["files"] == ["Look_test"]
+
+
+def test_deploy_space_recursive(mocker, tmp_path, pool):
+    child = tmp_path / "Shared" / "Bar" / "Baz"
+    child.mkdir(parents=True)
+    (tmp_path / "Shared" / "Bar" / "Look_test").write_text("{}")
+    (child / "Dashboard_test").write_text("{}")
+
+    mocker.patch("looker_deployer.commands.deploy_content.build_spaces")
+    deploy_content.build_spaces.return_value = "42"
+
+    mocker.patch("looker_deployer.commands.deploy_content.import_content")
+    deploy_content.deploy_space(str(tmp_path / "Shared" / "Bar"), "sdk", "creds", True, pool)
+    deploy_content.build_spaces.assert_called_with(["Shared", "Bar", "Baz"], "sdk")
+    deploy_content.import_content.assert_any_call(
+        "look",
+        str(tmp_path / "Shared" / "Bar" / "Look_test"),
+        "42",
+        "creds"
+    )
+    deploy_content.import_content.assert_any_call("dashboard", str(child / "Dashboard_test"), "42", "creds")